@@ -16,7 +16,7 @@ from sample_factory.algo.learning.rnn_utils import build_core_out_from_seq, buil
 from sample_factory.algo.utils.action_distributions import get_action_distribution, is_continuous_action_space
 from sample_factory.algo.utils.env_info import EnvInfo
 from sample_factory.algo.utils.misc import LEARNER_ENV_STEPS, POLICY_ID_KEY, STATS_KEY, TRAIN_STATS, memory_stats
-from sample_factory.algo.utils.model_sharing import ParameterServer
+from sample_factory.algo.utils.model_sharing import ParameterServer, SharedWeightsArena
 from sample_factory.algo.utils.optimizers import Lamb
 from sample_factory.algo.utils.rl_utils import gae_advantages, prepare_and_normalize_obs
 from sample_factory.algo.utils.shared_buffers import policy_device
@@ -114,10 +114,19 @@ def get_lr_scheduler(cfg) -> LearningRateScheduler:
 
 
 def model_initialization_data(
-    cfg: Config, policy_id: PolicyID, actor_critic: Module, policy_version: int, device: torch.device
+    cfg: Config,
+    policy_id: PolicyID,
+    actor_critic: Module,
+    policy_version: int,
+    device: torch.device,
+    weights_arena: Optional[SharedWeightsArena] = None,
 ) -> InitModelData:
-    # in serial mode we will just use the same actor_critic directly
-    state_dict = None if cfg.serial_mode else actor_critic.state_dict()
+    if weights_arena is not None:
+        # clients will use the weights published by the learner in the shared arena instead of the state dict
+        state_dict = weights_arena
+    else:
+        # in serial mode we will just use the same actor_critic directly
+        state_dict = None if cfg.serial_mode else actor_critic.state_dict()
     model_state = (policy_id, state_dict, device, policy_version)
     return model_state
 
@@ -243,7 +252,7 @@ class Learner(Configurable):
         self.optimizer = optimizer_cls(params, **optimizer_kwargs)
 
         self.load_from_checkpoint(self.policy_id)
-        self.param_server.init(self.actor_critic, self.train_step, self.device)
+        self.param_server.init(self.actor_critic, self.train_step, self.device, self.cfg.weight_buffers)
         self.policy_versions_tensor[self.policy_id] = self.train_step
 
         self.lr_scheduler = get_lr_scheduler(self.cfg)
@@ -252,7 +261,9 @@ class Learner(Configurable):
 
         self.is_initialized = True
 
-        return model_initialization_data(self.cfg, self.policy_id, self.actor_critic, self.train_step, self.device)
+        return model_initialization_data(
+            self.cfg, self.policy_id, self.actor_critic, self.train_step, self.device, self.param_server.weights_arena
+        )
 
     @staticmethod
     def checkpoint_dir(cfg, policy_id):
@@ -419,15 +430,20 @@ class Learner(Configurable):
                 # don't re-load progress if we are loading from another policy checkpoint
                 self.load_from_checkpoint(self.policy_to_load, load_progress=False)
 
-            # make sure everything (such as policy weights) is committed to shared device memory
-            synchronize(self.cfg, self.device)
             # this will force policy update on the inference worker (policy worker)
             # we add max_policy_lag steps so that all experience currently in batches is invalidated
             self.train_step += self.cfg.max_policy_lag + 1
-            self.policy_versions_tensor[self.policy_id] = self.train_step
+            self._update_policy_version()
 
             self.policy_to_load = None
 
+    def _update_policy_version(self) -> None:
+        if self.param_server.weights_arena is None:
+            # make sure everything (such as policy weights) is committed to shared device memory
+            synchronize(self.cfg, self.device)
+        # this will force policy update on the inference worker (policy worker)
+        self.param_server.update_weights(self.train_step)
+
     @staticmethod
     def _policy_loss(ratio, adv, clip_ratio_low, clip_ratio_high, valids, num_invalids: int):
         clipped_ratio = torch.clamp(ratio, clip_ratio_low, clip_ratio_high)
@@ -823,10 +839,7 @@ class Learner(Configurable):
                         del summary_vars
                         force_summaries = False
 
-                    # make sure everything (such as policy weights) is committed to shared device memory
-                    synchronize(self.cfg, self.device)
-                    # this will force policy update on the inference worker (policy worker)
-                    self.policy_versions_tensor[self.policy_id] = self.train_step
+                    self._update_policy_version()
 
             # end of an epoch
             if self.lr_scheduler.invoke_after_each_epoch():
@@ -1054,11 +1067,17 @@ class Learner(Configurable):
                 log.warning("No valid samples in the batch, with PBT this must mean we just replaced weights")
             else:
                 log.error(f"Learner {self.policy_id=} received an entire batch of invalid data, skipping...")
+            self.param_server.publish_pending_weights()
             return None
         else:
             with self.timing.add_time("train"):
                 train_stats = self._train(buff, self.cfg.batch_size, experience_size, num_invalids)
 
+            # make sure the clients get the final weights of this iteration (i.e. in sync mode they are about to
+            # collect the next batch of experience with these weights)
+            with self.timing.add_time("publish_weights"):
+                self.param_server.publish_pending_weights()
+
             # multiply the number of samples by frameskip so that FPS metrics reflect the number
             # of environment steps actually simulated
             if self.cfg.summaries_use_frameskip:
@@ -75,6 +75,12 @@ class LearnerWorker(HeartbeatStoppableEventLoopObject, Configurable):
         self.cache_cleanup_timer = Timer(self.event_loop, 30)
         self.cache_cleanup_timer.timeout.connect(self._cleanup_cache)
 
+        # retry publishing the weights that could not be published because all weight buffers were in use
+        self.publish_weights_timer: Optional[Timer] = None
+        if cfg.weight_buffers > 0 and not cfg.serial_mode:
+            self.publish_weights_timer = Timer(self.event_loop, 0.1)
+            self.publish_weights_timer.timeout.connect(self._publish_pending_weights)
+
     @signal
     def initialized(self): ...
 
@@ -148,11 +154,17 @@ class LearnerWorker(HeartbeatStoppableEventLoopObject, Configurable):
         if stats is not None:
             self.report_msg.emit(stats)
 
+    def _publish_pending_weights(self):
+        if self.learner.is_initialized:
+            self.param_server.publish_pending_weights()
+
     # noinspection PyMethodMayBeStatic
     def _cleanup_cache(self):
         torch.cuda.empty_cache()
 
     def on_stop(self, *args):
+        if self.publish_weights_timer is not None:
+            self.publish_weights_timer.stop()
         self.learner.save()
         if not self.cfg.serial_mode:
             self.join_batcher_thread()
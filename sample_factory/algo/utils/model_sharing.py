@@ -2,16 +2,76 @@
 Utilities for sharing model parameters between components.
 """
 
+import logging
 import sys
-from typing import Optional
+from typing import Dict, List, Optional, Tuple
 
 import torch
 from torch import Tensor
 
-from sample_factory.algo.utils.multiprocessing_utils import get_lock, get_mp_ctx
+from sample_factory.algo.utils.multiprocessing_utils import FakeLock, get_lock, get_mp_ctx
 from sample_factory.model.actor_critic import create_actor_critic
 from sample_factory.utils.timing import Timing
-from sample_factory.utils.utils import log
+from sample_factory.utils.utils import log, log_every_n
+
+
+class SharedWeightsArena:
+    """
+    Several copies ("slots") of the model state dict in shared (CPU or CUDA) memory.
+    The learner publishes new weights by copying them into a slot that nobody uses, and then marking this slot
+    as the latest one. Clients pin the latest slot and make their local model point to its tensors, so switching
+    to the new weights does not involve any copying.
+
+    The arena only holds the data, the bookkeeping must be done under the arena lock (see ParameterServer) that
+    cannot be sent to other processes after they are started.
+    """
+
+    def __init__(self, state_dict: Dict[str, Tensor], num_slots: int, policy_version: int):
+        assert num_slots >= 2, f"Need at least two weight buffers, got {num_slots}"
+
+        self.keys: List[str] = list(state_dict.keys())
+        self.slots: List[List[Tensor]] = []
+        for _ in range(num_slots):
+            slot = [self._share(t.detach().clone()) for t in state_dict.values()]
+            self.slots.append(slot)
+
+        self.slot_versions = self._share(torch.full([num_slots], -1, dtype=torch.int64))
+        self.slot_readers = self._share(torch.zeros([num_slots], dtype=torch.int32))
+        self.latest = self._share(torch.zeros([1], dtype=torch.int32))
+
+        self.slot_versions[0] = policy_version
+
+    @staticmethod
+    def _share(t: Tensor) -> Tensor:
+        return t if t.is_cuda else t.share_memory_()
+
+    @property
+    def num_slots(self) -> int:
+        return len(self.slots)
+
+    def latest_slot(self) -> int:
+        return int(self.latest[0].item())
+
+    def find_free_slot(self) -> int:
+        """Slot the learner can write to: not the latest and not pinned by any client. -1 if there is none."""
+        latest = self.latest_slot()
+        for i in range(self.num_slots):
+            slot = (latest + 1 + i) % self.num_slots
+            if slot != latest and self.slot_readers[slot].item() == 0:
+                return slot
+        return -1
+
+    def publish(self, slot: int, policy_version: int) -> None:
+        self.slot_versions[slot] = policy_version
+        self.latest[0] = slot
+
+    def pin_latest(self) -> Tuple[int, int]:
+        slot = self.latest_slot()
+        self.slot_readers[slot] += 1
+        return slot, int(self.slot_versions[slot].item())
+
+    def unpin(self, slot: int) -> None:
+        self.slot_readers[slot] -= 1
 
 
 class ParameterServer:
@@ -20,27 +80,104 @@ class ParameterServer:
         self.actor_critic = None
         self.policy_versions = policy_versions
         self.device: Optional[torch.device] = None
+        self.serial_mode = serial_mode
 
         mp_ctx = get_mp_ctx(serial_mode)
         self._policy_lock = get_lock(serial_mode, mp_ctx)
 
+        # multiprocessing locks can only be passed to other processes on startup, so we create this lock here
+        # even though the arena itself is allocated later, when the model is initialized
+        self._arena_lock = get_lock(serial_mode, mp_ctx)
+        self.weights_arena: Optional[SharedWeightsArena] = None
+        self._arena_weights: Optional[List[Tensor]] = None
+        # latest policy version that is not yet copied to the arena, -1 if there is none
+        self._pending_version: int = -1
+
     @property
     def policy_lock(self):
+        if self.weights_arena is not None:
+            # clients only read the weights from the arena, so nobody else can access the learner's weights
+            return FakeLock()
         return self._policy_lock
 
-    def init(self, actor_critic, policy_version, device: torch.device):
+    @property
+    def arena_lock(self):
+        return self._arena_lock
+
+    def init(self, actor_critic, policy_version, device: torch.device, num_weight_buffers: int = 0):
         self.actor_critic = actor_critic
         self.policy_versions[self.policy_id] = policy_version
         self.device = device
+
+        if num_weight_buffers > 0 and not self.serial_mode:
+            state_dict = actor_critic.state_dict()
+            self.weights_arena = SharedWeightsArena(state_dict, num_weight_buffers, policy_version)
+            self._arena_weights = list(state_dict.values())
+            log.debug("Allocated %d shared weight buffers for policy %d", num_weight_buffers, self.policy_id)
+
         log.debug("Initialized policy %d weights for model version %d", self.policy_id, policy_version)
 
+    def _copy_to_free_slot(self, policy_version) -> bool:
+        arena = self.weights_arena
+        with self._arena_lock:
+            slot = arena.find_free_slot()
+        if slot < 0:
+            return False
+
+        # nobody can pin this slot until we publish it, so we can write it without holding the lock
+        torch._foreach_copy_(arena.slots[slot], self._arena_weights)
+        if self.device is not None and self.device.type == "cuda":
+            # the copy is ordered after the optimizer step on the learner's stream, but clients use other streams
+            torch.cuda.synchronize(self.device)
+
+        with self._arena_lock:
+            arena.publish(slot, policy_version)
+        return True
+
+    def _clients_use_latest_weights(self) -> bool:
+        with self._arena_lock:
+            return self.weights_arena.slot_readers[self.weights_arena.latest_slot()].item() > 0
+
     def update_weights(self, policy_version):
         """
         In async algorithms policy_versions tensor is in shared memory.
         Therefore clients can just look at the location in shared memory once in a while to see if the
         weights are updated.
+
+        With the shared weights arena publishing requires a full copy of the weights on the learner, so we only do it
+        when clients have already switched to the previously published weights. Otherwise the new version stays
+        pending until the next update or publish_pending_weights() call.
         """
-        self.policy_versions[self.policy_id] = policy_version
+        if self.weights_arena is None:
+            self.policy_versions[self.policy_id] = policy_version
+            return
+
+        self._pending_version = policy_version
+        if self._clients_use_latest_weights():
+            self.publish_pending_weights()
+
+    def publish_pending_weights(self) -> bool:
+        """
+        Copy the latest weights to the arena if they were not published yet.
+        The learner calls this at the end of every training iteration (and periodically) so clients never keep
+        using an old version of the policy.
+        Returns False if the weights are still pending, i.e. all buffers are in use.
+        """
+        if self._pending_version < 0:
+            return True
+
+        if not self._copy_to_free_slot(self._pending_version):
+            # can only happen if some clients hold on to old buffers, i.e. there are not enough buffers
+            log_every_n(
+                100,
+                logging.WARNING,
+                f"No free weight buffers for policy {self.policy_id}, consider increasing --weight_buffers",
+            )
+            return False
+
+        self.policy_versions[self.policy_id] = self._pending_version
+        self._pending_version = -1
+        return True
 
 
 class ParameterClient:
@@ -100,6 +237,11 @@ class ParameterClientAsync(ParameterClient):
         self._shared_model_weights = None
         self.num_policy_updates = 0
 
+        self._weights_arena: Optional[SharedWeightsArena] = None
+        self._arena_lock = param_server.arena_lock
+        self._pinned_slot = -1
+        self._local_weights: Optional[List[Tensor]] = None
+
     @property
     def actor_critic(self):
         assert self.latest_policy_version >= 0, "Trying to access actor critic before it is initialized"
@@ -118,6 +260,10 @@ class ParameterClientAsync(ParameterClient):
 
         self._init_local_copy(device, self.cfg, self.env_info.obs_space, self.env_info.action_space)
 
+        if isinstance(state_dict, SharedWeightsArena):
+            self._init_arena_weights(state_dict)
+            return
+
         with self._policy_lock:
             if state_dict is None:
                 log.warning(f"Parameter client {self.policy_id} received empty state dict, using random weights...")
@@ -125,28 +271,66 @@ class ParameterClientAsync(ParameterClient):
                 self._actor_critic.load_state_dict(state_dict)
                 self._shared_model_weights = state_dict
 
+    def _init_arena_weights(self, arena: SharedWeightsArena) -> None:
+        local_state_dict = self._actor_critic.state_dict(keep_vars=True)
+        assert list(local_state_dict.keys()) == arena.keys, "Local model does not match the shared weights"
+
+        self._weights_arena = arena
+        # we will be replacing the storage of these tensors with the tensors from the arena
+        self._local_weights = list(local_state_dict.values())
+        self.latest_policy_version = self._switch_to_latest_slot()
+
+    def _switch_to_latest_slot(self) -> int:
+        """Pin the latest published slot and make the local model use its tensors. Returns the policy version."""
+        with self._arena_lock:
+            if self._pinned_slot >= 0:
+                self._weights_arena.unpin(self._pinned_slot)
+            self._pinned_slot, policy_version = self._weights_arena.pin_latest()
+
+        for local_t, shared_t in zip(self._local_weights, self._weights_arena.slots[self._pinned_slot]):
+            local_t.data = shared_t
+
+        return policy_version
+
     def ensure_weights_updated(self):
         server_policy_version = self._get_server_policy_version()
-        if self.latest_policy_version < server_policy_version and self._shared_model_weights is not None:
+        if self.latest_policy_version >= server_policy_version:
+            return
+
+        if self._weights_arena is not None:
+            # no copying and no waiting for the learner, just switch to the latest published buffer
+            with self.timing.time_avg("weight_update"):
+                server_policy_version = self._switch_to_latest_slot()
+        elif self._shared_model_weights is not None:
             with self.timing.time_avg("weight_update"), self._policy_lock:
                 self._actor_critic.load_state_dict(self._shared_model_weights)
+        else:
+            return
 
-            self.latest_policy_version = server_policy_version
+        self.latest_policy_version = server_policy_version
 
-            self.num_policy_updates += 1
-            if self.num_policy_updates % 1000 == 0:
-                log.info(
-                    "Updated weights for policy %d, policy_version %d (%s)",
-                    self.policy_id,
-                    self.latest_policy_version,
-                    str(self.timing.weight_update),
-                )
+        self.num_policy_updates += 1
+        if self.num_policy_updates % 1000 == 0:
+            log.info(
+                "Updated weights for policy %d, policy_version %d (%s)",
+                self.policy_id,
+                self.latest_policy_version,
+                str(self.timing.weight_update),
+            )
 
     def cleanup(self):
+        if self._weights_arena is not None and self._pinned_slot >= 0:
+            # release the buffer, otherwise the learner would never be able to reuse it
+            with self._arena_lock:
+                self._weights_arena.unpin(self._pinned_slot)
+            self._pinned_slot = -1
+
         # TODO: fix termination problems related to shared CUDA tensors (they are harmless but annoying)
         weights = self._shared_model_weights
         del self._actor_critic
         del self._shared_model_weights
+        del self._local_weights
+        del self._weights_arena
         del self.policy_versions
 
         if weights is not None:
@@ -133,6 +133,14 @@ def verify_cfg(cfg: Config, env_info: EnvInfo) -> bool:
         # batch.
         cfg_error("Normalized returns are not supported with vtrace!")
 
+    if not cfg.serial_mode and cfg.weight_buffers != 0 and cfg.weight_buffers < cfg.policy_workers_per_policy + 2:
+        # each inference worker pins one buffer and the latest published buffer is never overwritten,
+        # so we need at least one more to always have somewhere to publish new weights
+        cfg_error(
+            f"{cfg.weight_buffers=} must be 0 (disabled) or at least {cfg.policy_workers_per_policy + 2} "
+            f"(policy_workers_per_policy + 2)"
+        )
+
     if cfg.async_rl and cfg.serial_mode:
         log.warning(
             "In serial mode all components run on the same process. Only use async_rl "
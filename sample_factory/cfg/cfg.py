@@ -422,6 +422,15 @@ def add_rl_args(p: ArgumentParser):
         type=int,
         help="Niceness of the highest priority process (the learner). Values below zero require elevated privileges.",
     )
+    p.add_argument(
+        "--weight_buffers",
+        default=0,
+        type=int,
+        help="Number of copies of the policy weights kept in shared memory for the inference workers. Must be at least policy_workers_per_policy + 2. "
+        "Inference workers switch to the latest published copy without copying the parameters or waiting for the learner's lock. "
+        "The learner still copies the weights into a free buffer, but only after clients picked up the previous version and once at the end of each training iteration. "
+        "With 0 inference workers copy the weights with load_state_dict() after every policy update. Not used in serial mode.",
+    )
 
     # logging and summaries
     p.add_argument(
@@ -1,7 +1,7 @@
 from __future__ import annotations
 
 import argparse
-from typing import Any, Callable, Dict, Optional, Tuple, Union
+from typing import Any, Callable, Optional, Tuple, Union
 
 import torch
 from gymnasium import spaces
@@ -28,4 +28,5 @@ CreateEnvFunc = Callable[[str, Optional[Config], Optional[AttrDict], Optional[st
 # there currenly isn't a single class all distributions derive from, but we gotta use something for the type hint
 ActionDistribution = Any
 
-InitModelData = Tuple[PolicyID, Dict, torch.device, int]
+# policy id, state dict (or SharedWeightsArena if weight buffers are enabled), device, policy version
+InitModelData = Tuple[PolicyID, Any, torch.device, int]
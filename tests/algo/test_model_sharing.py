@@ -0,0 +1,199 @@
+import torch
+from gymnasium import spaces
+
+from sample_factory.algo.learning.learner import Learner
+from sample_factory.algo.sampling.sync_sampling_api import SyncSamplingAPI
+from sample_factory.algo.utils.env_info import extract_env_info
+from sample_factory.algo.utils.make_env import make_env_func_batched
+from sample_factory.algo.utils.model_sharing import ParameterClientAsync, ParameterServer, SharedWeightsArena
+from sample_factory.algo.utils.rl_utils import samples_per_trajectory
+from sample_factory.algo.utils.tensor_dict import cat_tensordicts
+from sample_factory.cfg.arguments import default_cfg
+from sample_factory.model.actor_critic import create_actor_critic
+from sample_factory.utils.attr_dict import AttrDict
+from sample_factory.utils.timing import Timing
+from sf_examples.train_custom_env_custom_model import parse_custom_args, register_custom_components
+
+
+def _make_model_and_clients(weight_buffers: int, num_clients: int = 1):
+    cfg = default_cfg(algo="APPO", env="test_model_sharing")
+    cfg.weight_buffers = weight_buffers
+    cfg.use_rnn = False
+    env_info = AttrDict(
+        obs_space=spaces.Dict(dict(obs=spaces.Box(-1, 1, shape=(8,)))),
+        action_space=spaces.Discrete(3),
+    )
+
+    policy_id = 0
+    policy_versions = torch.zeros([1], dtype=torch.int32)
+    param_server = ParameterServer(policy_id, policy_versions, serial_mode=False)
+
+    actor_critic = create_actor_critic(cfg, env_info.obs_space, env_info.action_space)
+    param_server.init(actor_critic, 0, torch.device("cpu"), cfg.weight_buffers)
+
+    clients = []
+    for _ in range(num_clients):
+        client = ParameterClientAsync(param_server, cfg, env_info, Timing())
+        client.on_weights_initialized(param_server.weights_arena, torch.device("cpu"), 0)
+        clients.append(client)
+
+    return actor_critic, param_server, clients
+
+
+def _perturb(model):
+    with torch.no_grad():
+        for p in model.parameters():
+            p.add_(torch.randn_like(p))
+
+
+def _weights_match(a, b) -> bool:
+    for t1, t2 in zip(a.state_dict().values(), b.state_dict().values()):
+        if not torch.equal(t1, t2):
+            return False
+    return True
+
+
+class TestWeightsArena:
+    def test_client_follows_learner(self):
+        actor_critic, param_server, (client,) = _make_model_and_clients(weight_buffers=3)
+        assert isinstance(param_server.weights_arena, SharedWeightsArena)
+        assert _weights_match(actor_critic, client.actor_critic)
+
+        for version in range(1, 6):
+            _perturb(actor_critic)
+            assert not _weights_match(actor_critic, client.actor_critic)
+
+            param_server.update_weights(version)
+            client.ensure_weights_updated()
+
+            assert client.policy_version == version
+            assert _weights_match(actor_critic, client.actor_critic)
+
+    def test_newest_version_is_published(self):
+        actor_critic, param_server, (client,) = _make_model_and_clients(weight_buffers=3)
+
+        # several SGD steps while the client is busy (or idle, i.e. in sync mode)
+        for version in range(1, 5):
+            _perturb(actor_critic)
+            param_server.update_weights(version)
+
+        # end of the training iteration, the learner does not take any more steps
+        assert param_server.publish_pending_weights()
+        assert param_server.policy_versions[0] == 4
+
+        client.ensure_weights_updated()
+        assert client.policy_version == 4
+        assert _weights_match(actor_critic, client.actor_critic)
+
+    def test_pending_weights_are_retried(self):
+        actor_critic, param_server, clients = _make_model_and_clients(weight_buffers=3, num_clients=2)
+        arena = param_server.weights_arena
+
+        # pin every buffer except the latest one: clients are on versions 0 and 1, version 2 is latest
+        for version in range(1, 3):
+            _perturb(actor_critic)
+            param_server.update_weights(version)
+            clients[version - 1].ensure_weights_updated()
+            assert param_server.publish_pending_weights()
+
+        assert [c.policy_version for c in clients] == [1, 2]
+        clients[1].cleanup()  # stopped inference worker must release its buffer
+
+        _perturb(actor_critic)
+        param_server.update_weights(3)
+        assert param_server.publish_pending_weights()
+        assert param_server.policy_versions[0] == 3
+
+        # now client 0 is pinned to version 1 and version 3 is latest, only the buffer with version 2 is free
+        clients[0].ensure_weights_updated()
+        assert clients[0].policy_version == 3
+        new_client = ParameterClientAsync(param_server, clients[0].cfg, clients[0].env_info, Timing())
+        new_client.on_weights_initialized(arena, torch.device("cpu"), 0)
+        assert new_client.policy_version == 3
+
+        _perturb(actor_critic)
+        param_server.update_weights(4)
+        assert param_server.publish_pending_weights()
+        clients[0].ensure_weights_updated()
+
+        # both clients are pinned to different buffers (3 and 4), and one of them is the latest,
+        # so we can still publish
+        _perturb(actor_critic)
+        param_server.update_weights(5)
+        assert param_server.publish_pending_weights()
+
+        # now neither of the two pinned buffers can be overwritten, and the latest one is not pinned by anyone
+        _perturb(actor_critic)
+        param_server.update_weights(6)
+        assert not param_server.publish_pending_weights()
+        assert param_server.policy_versions[0] == 5
+
+        # as soon as the client switches to the latest weights, the pending version goes through
+        new_client.ensure_weights_updated()
+        assert param_server.publish_pending_weights()
+        assert param_server.policy_versions[0] == 6
+
+        clients[0].ensure_weights_updated()
+        assert clients[0].policy_version == 6
+        assert _weights_match(actor_critic, clients[0].actor_critic)
+
+
+def test_sync_mode_clients_get_final_weights():
+    """Inference workers in other processes must collect experience with the last weights of each iteration."""
+    register_custom_components()
+
+    cfg = parse_custom_args(argv=["--algo=APPO", "--env=my_custom_env_v1", "--experiment=test_model_sharing"])
+    cfg.device = "cpu"
+    cfg.serial_mode = False
+    cfg.async_rl = False
+    cfg.num_workers = 2
+    cfg.num_envs_per_worker = 2
+    cfg.rollout = 8
+    cfg.batch_size = 32
+    cfg.num_batches_per_epoch = 2
+    cfg.use_rnn = False
+    cfg.recurrence = 1
+    cfg.decorrelate_envs_on_one_worker = False
+    cfg.weight_buffers = 3
+
+    tmp_env = make_env_func_batched(cfg, env_config=None)
+    env_info = extract_env_info(tmp_env, cfg)
+    tmp_env.close()
+
+    policy_id = 0
+    policy_versions = torch.zeros([cfg.num_policies], dtype=torch.int32).share_memory_()
+    param_server = ParameterServer(policy_id, policy_versions, cfg.serial_mode)
+    sampler = SyncSamplingAPI(cfg, env_info, param_servers={policy_id: param_server})
+
+    learner = Learner(cfg, env_info, policy_versions, policy_id, param_server)
+    init_model_data = learner.init()
+    assert isinstance(init_model_data[1], SharedWeightsArena)
+    sampler.start({policy_id: init_model_data})
+
+    try:
+        for _ in range(3):
+            trajectories = []
+            sampled = 0
+            while sampled < cfg.batch_size * cfg.num_batches_per_epoch:
+                traj = sampler.get_trajectories_sync()
+                sampled += samples_per_trajectory(traj)
+                trajectories.append(traj)
+
+            learner.train(cat_tensordicts(trajectories))
+            final_version = learner.train_step
+            assert final_version > 0 and final_version % cfg.num_batches_per_epoch == 0
+
+            # the rollouts that were collected during training use older versions, but soon we should see rollouts
+            # collected entirely with the final version of the iteration
+            seen_final_version = False
+            for _ in range(50):
+                traj = sampler.get_trajectories_sync()
+                versions = traj["policy_version"][traj["policy_id"] == policy_id]
+                assert versions.max().item() <= final_version
+                if versions.min().item() == final_version:
+                    seen_final_version = True
+                    break
+
+            assert seen_final_version
+    finally:
+        sampler.stop()
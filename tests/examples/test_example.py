@@ -1,9 +1,11 @@
 import shutil
 from os.path import isdir
-from typing import Callable, Tuple
+from typing import Callable, Optional, Tuple
 
 import pytest
 
+from sample_factory.algo.learning.learner import Learner
+from sample_factory.algo.runners.runner import Runner
 from sample_factory.algo.sampling.batched_sampling import BatchedVectorEnvRunner
 from sample_factory.algo.sampling.non_batched_sampling import NonBatchedVectorEnvRunner
 from sample_factory.algo.sampling.sampler import SerialSampler
@@ -61,6 +63,7 @@ def run_test_env(
     check_export: bool = False,
     register_custom_components_func: Callable = register_custom_components,
     env_name: str = "my_custom_env_v1",
+    check_runner_func: Optional[Callable[[Config, Runner], None]] = None,
 ):
     log.debug(f"Testing with parameters {locals()}...")
 
@@ -79,6 +82,9 @@ def run_test_env(
     status = runner.run()
     assert status == ExperimentStatus.SUCCESS
 
+    if check_runner_func is not None:
+        check_runner_func(cfg, runner)
+
     # then test the evaluation of the saved model
     status, avg_reward = enjoy(eval_cfg)
     log.debug(f"Test reward: {avg_reward:.4f}")
@@ -144,6 +150,26 @@ class TestExample:
         cfg.async_rl = async_rl
         run_test_env(cfg, eval_cfg)
 
+    @pytest.mark.parametrize("async_rl", [False, True])
+    def test_weight_buffers(self, async_rl: bool):
+        cfg, eval_cfg = default_test_cfg()
+        cfg.num_workers = 2
+        cfg.train_for_env_steps = 1000
+        cfg.num_batches_per_epoch = 2
+        cfg.async_rl = async_rl
+        cfg.use_rnn = eval_cfg.use_rnn = False
+        cfg.weight_buffers = 3
+
+        def check_final_weights_published(cfg_: Config, runner: Runner):
+            # the last checkpoint is saved when the learner stops, so it has the final train_step
+            checkpoints = Learner.get_checkpoints(Learner.checkpoint_dir(cfg_, 0))
+            final_train_step = Learner.load_checkpoint(checkpoints, "cpu")["train_step"]
+            assert final_train_step >= cfg_.num_batches_per_epoch
+            # inference workers can only see weights that were published by the learner
+            assert runner.buffer_mgr.policy_versions[0].item() == final_train_step
+
+        run_test_env(cfg, eval_cfg, check_runner_func=check_final_weights_published)
+
     @pytest.mark.parametrize("batched_sampling", [True, False])
     def test_chk_envs(self, batched_sampling: bool):
         cfg, eval_cfg = default_test_cfg()